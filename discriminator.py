@@ -12,6 +12,7 @@ class Discriminator(Model):
                  pad_type="reflect",
                  norm_type="batch"):
         super(Discriminator, self).__init__(name="Discriminator")
+        self.norm_type = norm_type
         if pad_type == "reflect":
             self.flat_pad = ReflectionPadding2D()
         elif pad_type == "constant":
@@ -0,0 +1,81 @@
+"""
+convert training images into TFRecord shards of already decoded pixels,
+train.py reads these shards instead of JPEG files when they exist
+"""
+import os
+import json
+from glob import glob
+from random import shuffle
+import tensorflow as tf
+from tqdm import tqdm
+
+
+def _bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _int64_feature(value):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
+def convert_folder(path, folder, num_shards, size=None):
+    file_list = glob(os.path.expanduser(os.path.join(path, folder, '*')))
+    # NOTE: images are often ordered video frames, shuffle them so that
+    #       neighbouring frames do not end up next to each other in shards
+    shuffle(file_list)
+    save_dir = os.path.expanduser(os.path.join(path, 'tfrecords'))
+    if not os.path.isdir(save_dir):
+        os.makedirs(save_dir)
+    # NOTE: remove shards of previous runs, which may use another `num_shards`
+    for f in glob(os.path.join(save_dir, f"{folder}-*.tfrecord")):
+        os.remove(f)
+
+    writers = [
+        tf.io.TFRecordWriter(os.path.join(
+            save_dir, f"{folder}-{i:05d}-of-{num_shards:05d}.tfrecord"))
+        for i in range(num_shards)]
+
+    for i, f in enumerate(tqdm(file_list, desc=folder)):
+        img = tf.image.decode_jpeg(tf.io.read_file(f), channels=3)
+        h, w = img.shape[0], img.shape[1]
+        if size is not None and min(h, w) > size:
+            # NOTE: shrink the shorter side to `size` while keeping aspect ratio
+            h, w = h * size // min(h, w), w * size // min(h, w)
+            img = tf.saturate_cast(tf.round(tf.image.resize(img, (h, w))), tf.uint8)
+        example = tf.train.Example(features=tf.train.Features(feature={
+            'height': _int64_feature(h),
+            'width': _int64_feature(w),
+            'image_raw': _bytes_feature(img.numpy().tobytes()),
+        }))
+        writers[i % num_shards].write(example.SerializeToString())
+
+    for writer in writers:
+        writer.close()
+    with open(os.path.join(save_dir, f"{folder}.json"), "w") as f:
+        json.dump({
+            'num_images': len(file_list),
+            'num_shards': num_shards,
+            'size': size,
+        }, f)
+
+
+def main(path, folders, num_shards, size):
+    for folder in folders:
+        convert_folder(path, folder, num_shards, size)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", type=str, help='path to your dataset')
+    parser.add_argument("--folders", type=str, nargs="+",
+                        default=["trainA", "trainB", "trainB_smooth"])
+    parser.add_argument("--num_shards", type=int, default=16)
+    # NOTE: without --size, raw full-resolution pixels are stored, which take
+    #       roughly 10-20x the disk space of the JPEG files, and as much RAM
+    #       when training with --cache_in_memory
+    parser.add_argument("--size", type=int, default=None,
+                        help='shrink shorter side of images to this size, '
+                             'unset keeps full resolution at 10-20x the size of JPEGs')
+    args = parser.parse_args()
+    main(args.path, args.folders, args.num_shards, args.size)
@@ -1,8 +1,9 @@
 import os
 import gc
+import json
 from glob import glob
-from itertools import product
 from random import choice
+from concurrent.futures import ThreadPoolExecutor
 
 from imageio import imwrite
 import tensorflow as tf
@@ -31,6 +32,7 @@ class Trainer:
         source_domain,
         target_domain,
         gan_type,
+        d_norm_type,
         epochs,
         input_size,
         multi_scale,
@@ -44,6 +46,9 @@ class Trainer:
         generator_lr,
         discriminator_lr,
         data_dir,
+        cache_in_memory,
+        cache_dir,
+        shuffle_buffer_size,
         log_dir,
         result_dir,
         checkpoint_dir,
@@ -54,6 +59,8 @@ class Trainer:
         model_dir,
         disable_sampling,
         ignore_vgg,
+        mixed_precision,
+        xla,
         pretrain_learning_rate,
         pretrain_epochs,
         pretrain_saving_epochs,
@@ -71,6 +78,7 @@ class Trainer:
         self.source_domain = source_domain
         self.target_domain = target_domain
         self.gan_type = gan_type
+        self.d_norm_type = d_norm_type
         self.epochs = epochs
         self.input_size = input_size
         self.multi_scale = multi_scale
@@ -84,6 +92,9 @@ class Trainer:
         self.generator_lr = generator_lr
         self.discriminator_lr = discriminator_lr
         self.data_dir = data_dir
+        self.cache_in_memory = cache_in_memory
+        self.cache_dir = cache_dir
+        self.shuffle_buffer_size = shuffle_buffer_size
         self.log_dir = log_dir
         self.result_dir = result_dir
         self.checkpoint_dir = checkpoint_dir
@@ -94,6 +105,8 @@ class Trainer:
         self.model_dir = model_dir
         self.disable_sampling = disable_sampling
         self.ignore_vgg = ignore_vgg
+        self.mixed_precision = mixed_precision
+        self.xla = xla
         self.pretrain_learning_rate = pretrain_learning_rate
         self.pretrain_epochs = pretrain_epochs
         self.pretrain_saving_epochs = pretrain_saving_epochs
@@ -103,6 +116,32 @@ class Trainer:
         self.discriminator_name = discriminator_name
 
         self.logger = get_logger("Trainer", debug=debug)
+        self.val_real_batch = None
+        # NOTE: sample images are written by a single background thread so
+        #       that file I/O does not block the training loop
+        self.io_executor = ThreadPoolExecutor(max_workers=1)
+        self.io_future = None
+        if self.mixed_precision:
+            # NOTE: pinned TensorFlow 2.0.0a0 predates the mixed precision graph
+            #       rewrite and loss scaling methods used by the training steps
+            try:
+                tf.train.experimental.enable_mixed_precision_graph_rewrite
+                tf.keras.mixed_precision.experimental.LossScaleOptimizer.get_scaled_loss
+            except AttributeError:
+                wrong_msg = ("`--mixed_precision` requires TensorFlow >= 2.1, "
+                             f"found {tf.__version__}")
+                self.logger.critical(wrong_msg)
+                raise ValueError(wrong_msg)
+        if self.xla:
+            try:
+                set_jit = tf.config.optimizer.set_jit
+            except AttributeError:
+                wrong_msg = f"`--xla` requires TensorFlow >= 2.0, found {tf.__version__}"
+                self.logger.critical(wrong_msg)
+                raise ValueError(wrong_msg)
+            self.logger.info("Enabling XLA JIT compilation for traced functions...")
+            set_jit(True)
+
         # NOTE: just minimal demonstration of multi-scale training
         self.sizes = [self.input_size - 32, self.input_size, self.input_size + 32]
 
@@ -127,21 +166,15 @@ class Trainer:
 
         self.logger.info(f"Setting up objective functions and metrics using {self.gan_type}...")
         self.mae = tf.keras.losses.MeanAbsoluteError()
-        self.generator_loss_object = tf.keras.losses.BinaryCrossentropy(from_logits=True)
-        if self.gan_type == "gan":
-            self.discriminator_loss_object = tf.keras.losses.BinaryCrossentropy(
-                from_logits=True)
-        elif self.gan_type == "lsgan":
-            self.discriminator_loss_object = tf.keras.losses.MeanSquaredError()
-        else:
+        if self.gan_type not in ("gan", "lsgan"):
             wrong_msg = f"Non-recognized 'gan_type': {self.gan_type}"
             self.logger.critical(wrong_msg)
             raise ValueError(wrong_msg)
 
         self.g_total_loss_metric = tf.keras.metrics.Mean("g_total_loss", dtype=tf.float32)
         self.g_adv_loss_metric = tf.keras.metrics.Mean("g_adversarial_loss", dtype=tf.float32)
-        if self.content_lambda != 0.:
-            self.content_loss_metric = tf.keras.metrics.Mean("content_loss", dtype=tf.float32)
+        # NOTE: pretraining always records content loss, even if content_lambda is 0
+        self.content_loss_metric = tf.keras.metrics.Mean("content_loss", dtype=tf.float32)
         if self.style_lambda != 0.:
             self.style_loss_metric = tf.keras.metrics.Mean("style_loss", dtype=tf.float32)
         self.d_total_loss_metric = tf.keras.metrics.Mean("d_total_loss", dtype=tf.float32)
@@ -179,27 +212,55 @@ class Trainer:
         if not isinstance(batch_x, np.ndarray):
             batch_x = batch_x.numpy()
         n, h, w, c = batch_x.shape
-        out_arr = np.zeros([h * nrow, w * ncol, 3], dtype=np.uint8)
-        for (i, j), k in zip(product(range(nrow), range(ncol)), range(n)):
-            out_arr[(h * i):(h * (i+1)), (w * j):(w * (j+1))] = batch_x[k]
+        n = min(n, nrow * ncol)
+        # NOTE: tile images into a grid with a single reshape/transpose
+        tiles = np.zeros([nrow * ncol, h, w, 3], dtype=np.uint8)
+        tiles[:n] = batch_x[:n]
+        out_arr = tiles.reshape(nrow, ncol, h, w, 3).transpose(0, 2, 1, 3, 4).reshape(
+            h * nrow, w * ncol, 3)
         if not os.path.isdir(self.result_dir):
             os.makedirs(self.result_dir)
-        imwrite(os.path.join(self.result_dir, image_name), out_arr)
+        self.wait_for_io()
+        self.io_future = self.io_executor.submit(
+            imwrite, os.path.join(self.result_dir, image_name), out_arr)
         gc.collect()
         return out_arr
 
+    def wait_for_io(self):
+        # NOTE: re-raise errors of the previous background write, if any
+        if self.io_future is not None:
+            self.io_future.result()
+            self.io_future = None
+
     @tf.function
     def random_resize(self, x):
         size = choice(self.sizes)
         return tf.image.resize(x, (size, size))
 
+    @tf.function
+    def decode_image(self, filename):
+        x = tf.io.read_file(filename)
+        return tf.image.decode_jpeg(x, channels=3)
+
+    @tf.function
+    def parse_example(self, serialized):
+        features = tf.io.parse_single_example(serialized, {
+            "height": tf.io.FixedLenFeature([], tf.int64),
+            "width": tf.io.FixedLenFeature([], tf.int64),
+            "image_raw": tf.io.FixedLenFeature([], tf.string),
+        })
+        x = tf.io.decode_raw(features["image_raw"], tf.uint8)
+        return tf.reshape(x, tf.stack([features["height"], features["width"], 3]))
+
     @tf.function
     def image_processing(self, filename, is_train=True):
+        return self.normalize(self.augment_image(self.decode_image(filename), is_train))
+
+    @tf.function
+    def augment_image(self, x, is_train=True):
         crop_size = self.input_size
         if self.multi_scale and is_train:
             crop_size += 32
-        x = tf.io.read_file(filename)
-        x = tf.image.decode_jpeg(x, channels=3)
         if is_train:
             sizes = tf.cast(
                 crop_size * tf.random.uniform([2], 0.9, 1.1), tf.int32)
@@ -207,30 +268,132 @@ class Trainer:
             sizes = tf.minimum(sizes, shape)
             x = tf.image.random_crop(x, (sizes[0], sizes[1], 3))
             x = tf.image.random_flip_left_right(x)
-        x = tf.image.resize(x, (crop_size, crop_size))
-        img = tf.cast(x, tf.float32) / 127.5 - 1
-        return img
+        x = tf.image.resize(x, (crop_size, crop_size), method=tf.image.ResizeMethod.BILINEAR)
+        return tf.saturate_cast(tf.round(x), tf.uint8)
 
-    def get_dataset(self, dataset_name, domain, _type, batch_size):
-        files = glob(os.path.join(self.data_dir, dataset_name, f"{_type}{domain}", "*"))
-        num_images = len(files)
-        self.logger.info(
-            f"Found {num_images} domain{domain} images in {_type}{domain} folder."
-        )
-        ds = tf.data.Dataset.from_tensor_slices(files)
-        ds = ds.apply(tf.data.experimental.shuffle_and_repeat(num_images))
+    @tf.function
+    def normalize(self, x):
+        # NOTE: a single multiply-add which grappler fuses into one kernel
+        return tf.cast(x, tf.float32) * (1. / 127.5) - 1.
+
+    def get_decoded_images(self, dataset_name, domain, _type):
+        # NOTE: prefer TFRecord shards generated by scripts/to_tfrecord.py,
+        #       which store decoded pixels and avoid opening every single file
+        record_dir = os.path.join(self.data_dir, dataset_name, "tfrecords")
+        meta_file = os.path.join(record_dir, f"{_type}{domain}.json")
+        if os.path.isfile(meta_file):
+            with open(meta_file) as f:
+                meta = json.load(f)
+            num_images, num_shards = meta["num_images"], meta["num_shards"]
+            source = f"tfrecord_{meta['size'] or 'full'}"
+            ds = tf.data.Dataset.list_files(
+                os.path.join(record_dir, f"{_type}{domain}-*-of-{num_shards:05d}.tfrecord"),
+                shuffle=True)
+            # NOTE: read fewer shards at a time than there are shards, so that
+            #       the shuffled shard order mixes images differently every epoch
+            ds = ds.interleave(
+                tf.data.TFRecordDataset,
+                cycle_length=max(1, num_shards // 4),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            ds = ds.map(self.parse_example, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        else:
+            ds = tf.data.Dataset.list_files(
+                os.path.join(self.data_dir, dataset_name, f"{_type}{domain}", "*"),
+                shuffle=True)
+            num_images = int(tf.data.experimental.cardinality(ds))
+            source = "jpeg"
+            # NOTE: read and decode files concurrently and prefetch so that input
+            #       pipeline overlaps with training steps instead of blocking them
+            ds = ds.interleave(
+                lambda fname: tf.data.Dataset.from_tensors(fname).map(self.decode_image),
+                cycle_length=16,
+                num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        return ds, num_images, source
 
-        def fn(fname):
+    def get_dataset(self, dataset_name, domain, _type, batch_size):
+        # NOTE: keep decoding and augmentation on CPU so that they do not
+        #       compete with training ops for the GPU
+        with tf.device("/cpu:0"):
+            ds, num_images, source = self.get_decoded_images(dataset_name, domain, _type)
+            self.logger.info(
+                f"Found {num_images} domain{domain} images in {_type}{domain}."
+            )
+            # NOTE: optionally cache decoded images so that every file is decoded
+            #       only once, random crop/flip are applied after caching to keep
+            #       augmentation. Decoded images are full resolution, so caching
+            #       is opt-in
+            if self.cache_dir:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                # NOTE: key the cache by image source so that a cache of JPEG
+                #       files or shards of another size is never reused
+                cache_prefix = os.path.join(
+                    self.cache_dir, f"{dataset_name}_{_type}{domain}_{source}")
+                lockfiles = glob(f"{cache_prefix}*.lockfile")
+                if lockfiles:
+                    wrong_msg = (f"Cache lockfile `{lockfiles[0]}` exists, either another "
+                                 "run is writing this cache or a previous run was killed "
+                                 "during its first epoch, in which case remove the lockfile")
+                    self.logger.critical(wrong_msg)
+                    raise FileExistsError(wrong_msg)
+                ds = ds.cache(cache_prefix)
+            elif self.cache_in_memory:
+                ds = ds.cache()
+            # NOTE: without cache, `list_files` reshuffles file names every epoch
+            #       and a small buffer of decoded images is enough. A cache replays
+            #       the order of the first epoch, so shuffle all cached images in
+            #       memory, where shuffle buffer shares image buffers with the cache
+            shuffle_buffer_size = self.shuffle_buffer_size
+            if shuffle_buffer_size is None:
+                shuffle_buffer_size = num_images if self.cache_in_memory else 128
+            ds = ds.shuffle(min(num_images, shuffle_buffer_size)).repeat()
+            ds = ds.map(lambda x: self.augment_image(x, True),
+                        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            ds = ds.batch(batch_size)
             if self.multi_scale:
-                return self.random_resize(self.image_processing(fname, True))
-            else:
-                return self.image_processing(fname, True)
-
-        ds = ds.apply(tf.data.experimental.map_and_batch(fn, batch_size))
+                ds = ds.map(lambda x: tf.saturate_cast(tf.round(self.random_resize(x)), tf.uint8),
+                            num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            # NOTE: order of training images is random anyway, let parallel reads
+            #       and maps yield out of order so a slow file does not stall batches
+            options = tf.data.Options()
+            options.experimental_deterministic = False
+            ds = ds.with_options(options)
         steps = int(np.ceil(num_images/batch_size))
+        if tf.test.is_gpu_available():
+            # NOTE: stage upcoming batches in GPU memory before they are needed
+            ds = ds.apply(tf.data.experimental.prefetch_to_device("/gpu:0", buffer_size=2))
+            with tf.device("/gpu:0"):
+                # user iter(ds) to avoid generating iterator every epoch
+                return iter(ds), steps
+        ds = ds.prefetch(tf.data.experimental.AUTOTUNE)
         # user iter(ds) to avoid generating iterator every epoch
         return iter(ds), steps
 
+    def get_sample_batch(self, domain):
+        # NOTE: fetch all sample images as one batch of `sample_size` from a
+        #       separate dataset instead of pulling training batches one by one
+        ds, _, _ = self.get_decoded_images(self.dataset_name, domain, "train")
+        # NOTE: repeat so that folders with fewer images still fill the batch
+        ds = ds.repeat().take(self.sample_size)
+        ds = ds.map(lambda x: self.augment_image(x, True),
+                    num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        sample_batch = next(iter(ds.batch(self.sample_size)))
+        # NOTE: same post-batch resize as training batches in multi-scale mode
+        if self.multi_scale:
+            sample_batch = tf.saturate_cast(tf.round(self.random_resize(sample_batch)), tf.uint8)
+        return self.normalize(sample_batch)
+
+    def get_val_real_batch(self):
+        # NOTE: validation images never change, decode them only once and
+        #       keep them on device for both pretraining and adversarial training
+        if self.val_real_batch is None:
+            val_files = glob(os.path.join(
+                self.data_dir, self.dataset_name, f"test{self.source_domain}", "*"))
+            self.val_real_batch = tf.map_fn(
+                lambda fname: self.image_processing(fname, False),
+                tf.constant(val_files), tf.float32, back_prop=False)
+        return self.val_real_batch
+
     @tf.function
     def pass_to_vgg(self, tensor):
         # NOTE: self.vgg should be fixed
@@ -238,6 +401,11 @@ class Trainer:
             tensor = self.vgg(tensor)
         return tensor
 
+    @tf.function
+    def generate_images(self, generator, input_images):
+        generated_images = generator(input_images, training=False)
+        return tf.cast(generated_images * 127.5 + 127.5, tf.uint8)
+
     @tf.function
     def content_loss(self, input_images, generated_images):
         return self.mae(input_images, generated_images)
@@ -250,26 +418,42 @@ class Trainer:
 
     @tf.function
     def discriminator_loss(self, real_output, fake_output, smooth_output):
-        real_loss = self.discriminator_loss_object(tf.ones_like(real_output), real_output)
-        fake_loss = self.discriminator_loss_object(tf.zeros_like(fake_output), fake_output)
-        smooth_loss = self.discriminator_loss_object(
-            tf.zeros_like(smooth_output), smooth_output)
+        # NOTE: labels are constant ones/zeros, so use the closed forms of
+        #       cross entropy and squared error instead of building label tensors
+        if self.gan_type == "gan":
+            real_loss = tf.reduce_mean(tf.nn.softplus(-real_output))
+            fake_loss = tf.reduce_mean(tf.nn.softplus(fake_output))
+            smooth_loss = tf.reduce_mean(tf.nn.softplus(smooth_output))
+        else:
+            real_loss = tf.reduce_mean(tf.square(real_output - 1.))
+            fake_loss = tf.reduce_mean(tf.square(fake_output))
+            smooth_loss = tf.reduce_mean(tf.square(smooth_output))
         total_loss = real_loss + fake_loss + smooth_loss
         return real_loss, fake_loss, smooth_loss, total_loss
 
     @tf.function
     def generator_adversarial_loss(self, fake_output):
-        return self.generator_loss_object(tf.ones_like(fake_output), fake_output)
+        # NOTE: binary cross entropy against ones, i.e. softplus(-logits)
+        return tf.reduce_mean(tf.nn.softplus(-fake_output))
 
     @tf.function
     def pretrain_step(self, input_images, generator, optimizer):
+        # NOTE: batches arrive as uint8 and are normalized on device
+        input_images = self.normalize(input_images)
+        # NOTE: features of real images need no gradients, keep them off the tape
+        vgg_input_images = self.pass_to_vgg(input_images)
 
         with tf.GradientTape() as tape:
             generated_images = generator(input_images, training=True)
             c_loss = self.content_lambda * self.content_loss(
-                self.pass_to_vgg(input_images), self.pass_to_vgg(generated_images))
-
-        gradients = tape.gradient(c_loss, generator.trainable_variables)
+                vgg_input_images, self.pass_to_vgg(generated_images))
+            loss = c_loss
+            if self.mixed_precision:
+                loss = optimizer.get_scaled_loss(loss)
+
+        gradients = tape.gradient(loss, generator.trainable_variables)
+        if self.mixed_precision:
+            gradients = optimizer.get_unscaled_gradients(gradients)
         optimizer.apply_gradients(zip(gradients, generator.trainable_variables))
 
         self.content_loss_metric(c_loss)
@@ -277,12 +461,41 @@ class Trainer:
     @tf.function
     def train_step(self, source_images, target_images, smooth_images,
                    generator, discriminator, g_optimizer, d_optimizer):
+        # NOTE: batches arrive as uint8 and are normalized on device
+        source_images = self.normalize(source_images)
+        target_images = self.normalize(target_images)
+        smooth_images = self.normalize(smooth_images)
+        # NOTE: features of real images need no gradients, compute them once
+        #       outside of the tapes and share them across losses
+        num_source = tf.shape(source_images)[0]
+        if self.content_lambda != 0. and self.style_lambda != 0.:
+            # NOTE: run VGG once on source and target images stacked along batch axis
+            vgg_real_images = self.pass_to_vgg(
+                tf.concat((source_images, target_images[:num_source]), 0))
+            vgg_source_images, vgg_target_images = tf.split(
+                vgg_real_images, [num_source, -1], 0)
+        elif self.content_lambda != 0.:
+            vgg_source_images = self.pass_to_vgg(source_images)
+        elif self.style_lambda != 0.:
+            vgg_target_images = self.pass_to_vgg(target_images[:num_source])
 
         with tf.GradientTape() as g_tape, tf.GradientTape() as d_tape:
-            real_output = discriminator(target_images, training=True)
             generated_images = generator(source_images, training=True)
-            fake_output = discriminator(generated_images, training=True)
-            smooth_out = discriminator(smooth_images, training=True)
+            if discriminator.norm_type == "instance":
+                # NOTE: run discriminator once on real, fake and smooth images
+                #       stacked along batch axis and split its output afterwards,
+                #       only safe without batch statistics shared across inputs
+                d_output = discriminator(
+                    tf.concat((target_images, generated_images, smooth_images), 0),
+                    training=True)
+                real_output, fake_output, smooth_out = tf.split(
+                    d_output,
+                    [tf.shape(target_images)[0], num_source, tf.shape(smooth_images)[0]],
+                    0)
+            else:
+                real_output = discriminator(target_images, training=True)
+                fake_output = discriminator(generated_images, training=True)
+                smooth_out = discriminator(smooth_images, training=True)
             d_real_loss, d_fake_loss, d_smooth_loss, d_total_loss = \
                 self.discriminator_loss(real_output, fake_output, smooth_out)
 
@@ -293,16 +506,23 @@ class Trainer:
                 vgg_generated_images = self.pass_to_vgg(generated_images)
                 if self.content_lambda != 0.:
                     c_loss = self.content_lambda * self.content_loss(
-                        self.pass_to_vgg(source_images), vgg_generated_images)
+                        vgg_source_images, vgg_generated_images)
                     g_total_loss = g_total_loss + c_loss
                 if self.style_lambda != 0.:
                     s_loss = self.style_lambda * self.style_loss(
-                        self.pass_to_vgg(target_images[:vgg_generated_images.shape[0]]),
-                        vgg_generated_images)
+                        vgg_target_images, vgg_generated_images)
                     g_total_loss = g_total_loss + s_loss
 
-        d_grads = d_tape.gradient(d_total_loss, discriminator.trainable_variables)
-        g_grads = g_tape.gradient(g_total_loss, generator.trainable_variables)
+            d_loss, g_loss = d_total_loss, g_total_loss
+            if self.mixed_precision:
+                d_loss = d_optimizer.get_scaled_loss(d_loss)
+                g_loss = g_optimizer.get_scaled_loss(g_loss)
+
+        d_grads = d_tape.gradient(d_loss, discriminator.trainable_variables)
+        g_grads = g_tape.gradient(g_loss, generator.trainable_variables)
+        if self.mixed_precision:
+            d_grads = d_optimizer.get_unscaled_gradients(d_grads)
+            g_grads = g_optimizer.get_unscaled_gradients(g_grads)
 
         d_optimizer.apply_gradients(zip(d_grads, discriminator.trainable_variables))
         g_optimizer.apply_gradients(zip(g_grads, generator.trainable_variables))
@@ -344,6 +564,9 @@ class Trainer:
         optimizer = tf.keras.optimizers.Adam(
             learning_rate=self.pretrain_learning_rate,
             beta_1=0.5)
+        if self.mixed_precision:
+            self.logger.info("Enabling mixed precision with dynamic loss scaling...")
+            optimizer = tf.train.experimental.enable_mixed_precision_graph_rewrite(optimizer)
 
         self.logger.info(f"Try restoring checkpoint: `{self.pretrain_checkpoint_prefix}`...")
         try:
@@ -369,15 +592,8 @@ class Trainer:
             epochs = self.pretrain_epochs
 
         if not self.disable_sampling:
-            val_files = glob(os.path.join(
-                self.data_dir, self.dataset_name, f"test{self.source_domain}", "*"))
-            val_real_batch = tf.map_fn(
-                lambda fname: self.image_processing(fname, False),
-                tf.constant(val_files), tf.float32, back_prop=False)
-            real_batch = next(dataset)
-            while real_batch.shape[0] < self.sample_size:
-                real_batch = tf.concat((real_batch, next(dataset)), 0)
-            real_batch = real_batch[:self.sample_size]
+            val_real_batch = self.get_val_real_batch()
+            real_batch = self.get_sample_batch(self.source_domain)
             with summary_writer.as_default():
                 img = np.expand_dims(self._save_generated_images(
                     tf.cast((real_batch + 1) * 127.5, tf.uint8),
@@ -414,8 +630,7 @@ class Trainer:
                                           self.content_loss_metric.result(),
                                           step=global_step)
                         if not self.disable_sampling:
-                            fake_batch = tf.cast(
-                                (generator(real_batch, training=False) + 1) * 127.5, tf.uint8)
+                            fake_batch = self.generate_images(generator, real_batch)
                             img = np.expand_dims(self._save_generated_images(
                                     fake_batch,
                                     image_name=(f"pretrain_generated_images_at_epoch_{epoch_idx}"
@@ -426,8 +641,7 @@ class Trainer:
                     self.content_loss_metric.reset_states()
             with summary_writer.as_default():
                 if not self.disable_sampling:
-                    val_fake_batch = tf.cast(
-                        (generator(val_real_batch, training=False) + 1) * 127.5, tf.uint8)
+                    val_fake_batch = self.generate_images(generator, val_real_batch)
                     img = np.expand_dims(self._save_generated_images(
                             val_fake_batch,
                             image_name=("pretrain_val_generated_images_at_epoch_"
@@ -467,6 +681,10 @@ class Trainer:
         self.logger.info("Setting up optimizer to update generator and discriminator...")
         g_optimizer = tf.keras.optimizers.Adam(learning_rate=self.generator_lr, beta_1=.5)
         d_optimizer = tf.keras.optimizers.Adam(learning_rate=self.discriminator_lr, beta_1=.5)
+        if self.mixed_precision:
+            self.logger.info("Enabling mixed precision with dynamic loss scaling...")
+            g_optimizer = tf.train.experimental.enable_mixed_precision_graph_rewrite(g_optimizer)
+            d_optimizer = tf.train.experimental.enable_mixed_precision_graph_rewrite(d_optimizer)
         if self.multi_scale:
             self.logger.info(f"Initializing generator with "
                              f"batch_size: {self.batch_size}, input_size: multi-scale...")
@@ -526,7 +744,7 @@ class Trainer:
             d_base_filters = 24
         else:
             d_base_filters = 32
-        d = Discriminator(base_filters=d_base_filters)
+        d = Discriminator(base_filters=d_base_filters, norm_type=self.d_norm_type)
         d(tf.keras.Input(
             shape=(self.input_size, self.input_size, 3),
             batch_size=self.batch_size))
@@ -543,15 +761,8 @@ class Trainer:
             self.logger.info("specified checkpoint is not found, training from scratch...")
 
         if not self.disable_sampling:
-            val_files = glob(os.path.join(
-                self.data_dir, self.dataset_name, f"test{self.source_domain}", "*"))
-            val_real_batch = tf.map_fn(
-                lambda fname: self.image_processing(fname, False),
-                tf.constant(val_files), tf.float32, back_prop=False)
-            real_batch = next(ds_source)
-            while real_batch.shape[0] < self.sample_size:
-                real_batch = tf.concat((real_batch, next(ds_source)), 0)
-            real_batch = real_batch[:self.sample_size]
+            val_real_batch = self.get_val_real_batch()
+            real_batch = self.get_sample_batch(self.source_domain)
             with summary_writer.as_default():
                 img = np.expand_dims(self._save_generated_images(
                     tf.cast((real_batch + 1) * 127.5, tf.uint8),
@@ -590,8 +801,7 @@ class Trainer:
                             tf.summary.scalar(name, metric.result(), step=global_step)
                             metric.reset_states()
                         if not self.disable_sampling:
-                            fake_batch = tf.cast(
-                                (generator(real_batch, training=False) + 1) * 127.5, tf.uint8)
+                            fake_batch = self.generate_images(generator, real_batch)
                             img = np.expand_dims(self._save_generated_images(
                                     fake_batch,
                                     image_name=("gan_generated_images_at_epoch_"
@@ -605,8 +815,7 @@ class Trainer:
 
             with summary_writer.as_default():
                 if not self.disable_sampling:
-                    val_fake_batch = tf.cast(
-                        (generator(val_real_batch, training=False) + 1) * 127.5, tf.uint8)
+                    val_fake_batch = self.generate_images(generator, val_real_batch)
                     img = np.expand_dims(self._save_generated_images(
                             val_fake_batch,
                             image_name=("gan_val_generated_images_at_epoch_"
@@ -636,6 +845,8 @@ def main(**kwargs):
         t.pretrain_generator()
     elif mode == "gan":
         t.train_gan()
+    t.wait_for_io()
+    t.io_executor.shutdown(wait=True)
 
 
 if __name__ == "__main__":
@@ -648,11 +859,14 @@ if __name__ == "__main__":
     parser.add_argument("--light", action="store_true")
     parser.add_argument("--input_size", type=int, default=256)
     parser.add_argument("--multi_scale", action="store_true")
-    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--batch_size", type=int, default=4)
     parser.add_argument("--sample_size", type=int, default=8)
     parser.add_argument("--source_domain", type=str, default="A")
     parser.add_argument("--target_domain", type=str, default="B")
     parser.add_argument("--gan_type", type=str, default="lsgan", choices=["gan", "lsgan"])
+    parser.add_argument("--d_norm_type", type=str, default="batch", choices=["batch", "instance"],
+                        help="instance norm lets real, fake and smooth images share "
+                             "a single discriminator pass")
     parser.add_argument("--epochs", type=int, default=100)
     parser.add_argument("--reporting_steps", type=int, default=100)
     parser.add_argument("--content_lambda", type=float, default=10)
@@ -662,11 +876,23 @@ if __name__ == "__main__":
     parser.add_argument("--generator_lr", type=float, default=1e-5)
     parser.add_argument("--discriminator_lr", type=float, default=1e-5)
     parser.add_argument("--ignore_vgg", action="store_true")
+    parser.add_argument("--mixed_precision", action="store_true")
+    parser.add_argument("--xla", action="store_true")
     parser.add_argument("--pretrain_learning_rate", type=float, default=1e-5)
     parser.add_argument("--pretrain_epochs", type=int, default=2)
     parser.add_argument("--pretrain_saving_epochs", type=int, default=1)
     parser.add_argument("--pretrain_reporting_steps", type=int, default=100)
     parser.add_argument("--data_dir", type=str, default="datasets")
+    parser.add_argument("--cache_in_memory", action="store_true",
+                        help="cache decoded full-resolution images in memory")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="cache decoded images to files in this directory, "
+                             "a run killed during its first epoch leaves a lockfile "
+                             "behind which has to be removed by hand")
+    parser.add_argument("--shuffle_buffer_size", type=int, default=None,
+                        help="number of decoded images to shuffle, defaults to all "
+                             "images with --cache_in_memory and 128 otherwise; "
+                             "raise it with --cache_dir to shuffle cached images better")
     parser.add_argument("--log_dir", type=str, default="runs")
     parser.add_argument("--result_dir", type=str, default="result")
     parser.add_argument("--checkpoint_dir", type=str, default="training_checkpoints")